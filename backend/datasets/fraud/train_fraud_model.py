@@ -1,18 +1,28 @@
 #!/usr/bin/env python3
 """
 Fraud Detection Model Training Script
-Trains a Random Forest model on the fraud dataset and exports to ONNX format
+Trains a Histogram Gradient Boosting model on the fraud dataset and exports to ONNX format
 """
 
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import StratifiedShuffleSplit
 from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import classification_report, confusion_matrix, roc_auc_score, precision_recall_curve
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.inspection import permutation_importance
+from sklearn.metrics import classification_report, roc_auc_score, precision_recall_curve
 import joblib
+from threadpoolctl import threadpool_limits
+import ctypes
+import glob
+import hashlib
 import json
+import math
 import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # For ONNX conversion
 try:
@@ -24,17 +34,189 @@ except ImportError:
     print("WARNING: skl2onnx not installed. Install with: pip install skl2onnx onnx")
     ONNX_AVAILABLE = False
 
+# For ONNX graph optimization
+try:
+    import onnxoptimizer
+    ONNX_OPTIMIZER_AVAILABLE = True
+except ImportError:
+    print("WARNING: onnxoptimizer not installed. Install with: pip install onnxoptimizer")
+    ONNX_OPTIMIZER_AVAILABLE = False
+
+# For ONNX Runtime reloading of the exported model
+try:
+    import onnxruntime as ort
+    ORT_AVAILABLE = True
+except ImportError:
+    print("WARNING: onnxruntime not installed. Install with: pip install onnxruntime")
+    ORT_AVAILABLE = False
+
+# For multi-threaded CSV ingestion
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    PYARROW_AVAILABLE = True
+except ImportError:
+    print("WARNING: pyarrow not installed. Install with: pip install pyarrow")
+    PYARROW_AVAILABLE = False
+
+# For fast artifact compression
+try:
+    import lz4  # noqa: F401 - registers joblib's 'lz4' compressor
+    ARTIFACT_COMPRESS = ('lz4', 3)
+except ImportError:
+    print("WARNING: lz4 not installed. Install with: pip install lz4")
+    ARTIFACT_COMPRESS = ('zlib', 3)
+
+# For JIT-compiled feature engineering
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    print("WARNING: numba not installed. Install with: pip install numba")
+    NUMBA_AVAILABLE = False
+
 # Configuration
 DATA_FILE = 'fraud_dataset.csv'
 MODELS_DIR = '../../src/main/resources/models'
+CACHE_DIR = '.cache'  # Engineered feature matrices, keyed by dataset mtime
 TEST_SIZE = 0.2
 RANDOM_STATE = 42
+VERBOSE = os.environ.get('TRAIN_VERBOSE', '').lower() in ('1', 'true', 'yes')  # Extra dataset diagnostics
+N_JOBS = max(1, (os.cpu_count() or 2) // 2)  # Physical cores, not SMT threads
 
 # Model hyperparameters
-N_ESTIMATORS = 150
-MAX_DEPTH = 15
-MIN_SAMPLES_SPLIT = 20
-MIN_SAMPLES_LEAF = 10
+MAX_ITER = 300
+MAX_ITER_SWEEP = [100, 200, MAX_ITER]  # Grown incrementally via warm start
+MAX_DEPTH = 8
+LEARNING_RATE = 0.05
+L2_REGULARIZATION = 1.0
+MAX_BINS = 255  # Features are binned to uint8 before split finding
+
+# Native model compilation (generated C)
+NATIVE_TOOLCHAIN = 'gcc'
+NATIVE_CFLAGS = ['-O3', '-march=native', '-shared', '-fPIC']
+
+# ONNX export
+ONNX_TARGET_OPSET = 17
+ONNX_OUTPUT = 'probabilities'  # Only graph output kept: [N, 2] float32 class probabilities
+ONNX_OPTIMIZER_PASSES = ['eliminate_identity', 'fuse_consecutive_concats', 'eliminate_deadend']
+
+# Parity checks of the exported models against predict_proba
+PARITY_SAMPLES = 2000
+
+# Feature columns (matching the order that will be used in Java)
+FEATURE_COLUMNS = [
+    # Amount features
+    'amount',
+    'amount_log',
+    'amount_sqrt',
+    
+    # Time features
+    'hour',
+    'hour_sin',
+    'hour_cos',
+    'is_night',
+    'is_business_hours',
+    
+    # Categorical encoded features
+    'transaction_type_encoded',
+    'merchant_category_encoded',
+    'country_encoded',
+    
+    # Risk scores
+    'device_risk_score',
+    'ip_risk_score',
+    'risk_score_product',
+    'risk_score_avg',
+    'risk_score_max'
+]
+
+# Cyclical hour encoding, precomputed for each of the 24 hours
+_HOUR_ANGLES = 2 * np.pi * np.arange(24) / 24
+HOUR_SIN = np.sin(_HOUR_ANGLES).astype(np.float32)
+HOUR_COS = np.cos(_HOUR_ANGLES).astype(np.float32)
+
+# Categorical columns, encoded into FEATURE_COLUMNS[8:11]
+CATEGORICAL_COLUMNS = ['transaction_type', 'merchant_category', 'country']
+
+def _engineer_numpy(amount, hour, device_risk, ip_risk, X):
+    """Vectorized fallback for the numeric feature kernel"""
+    # Hours are integral, so sin/cos are table gathers rather than libm calls;
+    # missing hours stay NaN so the trees take their missing-value branches
+    hour_ok = np.isfinite(hour)
+    hour_idx = hour[hour_ok].astype(np.intp) % 24
+    
+    X[:, 0] = amount
+    np.log1p(amount, out=X[:, 1])
+    np.sqrt(amount, out=X[:, 2])
+    X[:, 3] = hour
+    X[:, 4:6] = np.nan
+    X[hour_ok, 4] = HOUR_SIN[hour_idx]
+    X[hour_ok, 5] = HOUR_COS[hour_idx]
+    X[:, 6] = (hour <= 6) | (hour >= 22)
+    X[:, 7] = (hour >= 9) & (hour <= 17)
+    X[:, 11] = device_risk
+    X[:, 12] = ip_risk
+    np.multiply(device_risk, ip_risk, out=X[:, 13])
+    X[:, 14] = (device_risk + ip_risk) * 0.5
+    # NaN-skipping max, like DataFrame.max(axis=1)
+    np.fmax(device_risk, ip_risk, out=X[:, 15])
+
+if NUMBA_AVAILABLE:
+    # No fastmath: its no-NaN assumption breaks the comparisons on missing hours
+    @njit(parallel=True, cache=True)
+    def _engineer(amount, hour, device_risk, ip_risk, X):
+        """Write all numeric features into X in one parallel sweep over the rows"""
+        for i in prange(amount.shape[0]):
+            a = amount[i]
+            h = hour[i]
+            d = device_risk[i]
+            r = ip_risk[i]
+            
+            X[i, 0] = a
+            X[i, 1] = math.log1p(a)
+            X[i, 2] = math.sqrt(a)
+            X[i, 3] = h
+            if math.isfinite(h):
+                k = int(h) % 24
+                X[i, 4] = HOUR_SIN[k]
+                X[i, 5] = HOUR_COS[k]
+            else:
+                X[i, 4] = math.nan
+                X[i, 5] = math.nan
+            X[i, 6] = 1.0 if (h <= 6 or h >= 22) else 0.0
+            X[i, 7] = 1.0 if (h >= 9 and h <= 17) else 0.0
+            X[i, 11] = d
+            X[i, 12] = r
+            X[i, 13] = d * r
+            X[i, 14] = (d + r) * 0.5
+            X[i, 15] = r if (math.isnan(d) or r > d) else d
+else:
+    _engineer = _engineer_numpy
+
+def check_engineer_parity():
+    """Compare the numba kernel against the NumPy fallback, including missing inputs"""
+    hour = np.array([0, 6, 9, 16, 17, 22, 23, np.nan], dtype=np.float32)
+    amount = np.array([0, 1, 12.5, 80, 250, 1000, np.nan, 40], dtype=np.float32)
+    device_risk = np.array([0, 0.1, 0.5, 0.9, 1, np.nan, 0.3, 0.7], dtype=np.float32)
+    ip_risk = np.array([1, 0.2, 0.5, 0.1, np.nan, 0.4, 0.3, 0.6], dtype=np.float32)
+    
+    X_expected = np.zeros((len(hour), len(FEATURE_COLUMNS)), dtype=np.float32)
+    X_actual = np.zeros_like(X_expected)
+    _engineer_numpy(amount, hour, device_risk, ip_risk, X_expected)
+    _engineer(amount, hour, device_risk, ip_risk, X_actual)
+    
+    return np.allclose(X_actual, X_expected, rtol=1e-6, atol=0, equal_nan=True)
+
+# Narrow dtypes for the numeric CSV columns; floats so that empty cells and
+# pandas-written integers like "15.0" still load (as in plain pd.read_csv)
+CSV_COLUMN_TYPES = {
+    'amount': 'float32',
+    'hour': 'float32',
+    'device_risk_score': 'float32',
+    'ip_risk_score': 'float32',
+    'is_fraud': 'float32'
+}
 
 def create_dirs():
     """Create necessary directories"""
@@ -47,22 +229,33 @@ def load_and_explore_data():
     print("STEP 1: Loading Dataset")
     print("="*60)
     
-    df = pd.read_csv(DATA_FILE)
+    if PYARROW_AVAILABLE:
+        # Multi-threaded parse straight into narrow Arrow-backed columns
+        convert_options = pacsv.ConvertOptions(column_types={
+            name: pa.from_numpy_dtype(np.dtype(dtype))
+            for name, dtype in CSV_COLUMN_TYPES.items()
+        })
+        table = pacsv.read_csv(DATA_FILE, convert_options=convert_options)
+        df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    else:
+        df = pd.read_csv(DATA_FILE, dtype=CSV_COLUMN_TYPES)
     print(f"✓ Dataset loaded: {df.shape[0]} rows, {df.shape[1]} columns")
-    print(f"\nColumns: {', '.join(df.columns.tolist())}")
-    print(f"\nFirst few rows:")
-    print(df.head())
-    
-    # Check for missing values
-    missing = df.isnull().sum()
-    if missing.any():
-        print(f"\n⚠ Missing values found:")
-        print(missing[missing > 0])
+    if VERBOSE:
+        print(f"\nColumns: {', '.join(df.columns.tolist())}")
+        print(f"\nFirst few rows:")
+        print(df.head())
+    
+    # Check for missing values (short-circuits; per-column counts only when verbose)
+    if df.isna().any().any():
+        print(f"\n⚠ Missing values found")
+        if VERBOSE:
+            missing = df.isna().sum()
+            print(missing[missing > 0])
     else:
         print("\n✓ No missing values")
     
     # Class distribution
-    fraud_count = df['is_fraud'].sum()
+    fraud_count = int(df['is_fraud'].sum())
     fraud_pct = (fraud_count / len(df)) * 100
     print(f"\nClass Distribution:")
     print(f"  Legitimate: {len(df) - fraud_count} ({100-fraud_pct:.2f}%)")
@@ -71,146 +264,194 @@ def load_and_explore_data():
     return df
 
 def feature_engineering(df):
-    """Engineer features from the dataset"""
+    """Engineer features from the dataset straight into a float32 feature matrix"""
     print("\n" + "="*60)
     print("STEP 2: Feature Engineering")
     print("="*60)
     
-    df = df.copy()
+    feature_columns = FEATURE_COLUMNS
+    X = np.empty((len(df), len(feature_columns)), dtype=np.float32)
     
-    # Numeric transformations
-    df['amount_log'] = np.log1p(df['amount'])
-    df['amount_sqrt'] = np.sqrt(df['amount'])
+    # Pull the raw columns out once and write every numeric feature in a single pass
+    amount = df['amount'].to_numpy(dtype=np.float32)
+    hour = df['hour'].to_numpy(dtype=np.float32)
+    device_risk = df['device_risk_score'].to_numpy(dtype=np.float32)
+    ip_risk = df['ip_risk_score'].to_numpy(dtype=np.float32)
     
-    # Time features
-    df['hour_sin'] = np.sin(2 * np.pi * df['hour'] / 24)
-    df['hour_cos'] = np.cos(2 * np.pi * df['hour'] / 24)
-    df['is_night'] = ((df['hour'] >= 0) & (df['hour'] <= 6) | (df['hour'] >= 22)).astype(int)
-    df['is_business_hours'] = ((df['hour'] >= 9) & (df['hour'] <= 17)).astype(int)
+    if NUMBA_AVAILABLE and not check_engineer_parity():
+        raise ValueError("numba feature kernel disagrees with the NumPy fallback")
+    _engineer(amount, hour, device_risk, ip_risk, X)
+    print(f"Numeric features computed with {'numba' if NUMBA_AVAILABLE else 'numpy'}")
     
     # Encode categorical features
     encoders = {}
     
     print("\nEncoding categorical features:")
-    for col in ['transaction_type', 'merchant_category', 'country']:
+    for col in CATEGORICAL_COLUMNS:
+        # Hashed single-pass encode; sorted classes keep LabelEncoder's codes
+        codes, classes = pd.factorize(df[col].to_numpy(), sort=True)
+        X[:, feature_columns.index(f'{col}_encoded')] = codes
+        
+        # Persist as a regular LabelEncoder so consumers can still transform()
         le = LabelEncoder()
-        df[f'{col}_encoded'] = le.fit_transform(df[col])
+        le.classes_ = np.asarray(classes)
         encoders[col] = le
         print(f"  {col}: {len(le.classes_)} unique values -> {list(le.classes_)[:5]}...")
     
-    # Save encoders
-    for name, encoder in encoders.items():
-        joblib.dump(encoder, f'{MODELS_DIR}/encoder_{name}.pkl')
-    
-    print(f"\n✓ Saved {len(encoders)} label encoders")
-    
-    # Risk score interactions
-    df['risk_score_product'] = df['device_risk_score'] * df['ip_risk_score']
-    df['risk_score_avg'] = (df['device_risk_score'] + df['ip_risk_score']) / 2
-    df['risk_score_max'] = df[['device_risk_score', 'ip_risk_score']].max(axis=1)
-    
-    print(f"\n✓ Created {df.shape[1] - 10} engineered features")
-    
-    return df, encoders
-
-def prepare_features(df):
-    """Select and prepare features for model training"""
-    print("\n" + "="*60)
-    print("STEP 3: Feature Selection")
-    print("="*60)
-    
-    # Feature columns (matching the order that will be used in Java)
-    feature_columns = [
-        # Amount features
-        'amount',
-        'amount_log',
-        'amount_sqrt',
-        
-        # Time features
-        'hour',
-        'hour_sin',
-        'hour_cos',
-        'is_night',
-        'is_business_hours',
-        
-        # Categorical encoded features
-        'transaction_type_encoded',
-        'merchant_category_encoded',
-        'country_encoded',
-        
-        # Risk scores
-        'device_risk_score',
-        'ip_risk_score',
-        'risk_score_product',
-        'risk_score_avg',
-        'risk_score_max'
-    ]
+    y = df['is_fraud'].to_numpy(dtype=np.int8)
     
-    print(f"Selected {len(feature_columns)} features:")
+    print(f"\nSelected {len(feature_columns)} features:")
     for i, feat in enumerate(feature_columns, 1):
         print(f"  {i:2d}. {feat}")
     
-    X = df[feature_columns].values
-    y = df['is_fraud'].values
-    
     print(f"\n✓ Feature matrix: {X.shape}")
     print(f"✓ Target vector: {y.shape}")
     
-    return X, y, feature_columns
+    return X, y, feature_columns, encoders
+
+def _feature_cache_key():
+    """Cache key for the engineered features of the current dataset and pipeline"""
+    key_source = json.dumps([
+        os.path.getmtime(DATA_FILE),
+        os.path.getmtime(__file__),
+        FEATURE_COLUMNS,
+        NUMBA_AVAILABLE
+    ])
+    return hashlib.sha1(key_source.encode()).hexdigest()[:16]
+
+def load_features():
+    """Load the engineered features from cache, or build and cache them"""
+    key = _feature_cache_key()
+    features_path = f'{CACHE_DIR}/features_{key}.npz'
+    encoders_path = f'{CACHE_DIR}/encoders_{key}.pkl'
+    
+    if os.path.exists(features_path) and os.path.exists(encoders_path):
+        print("\n" + "="*60)
+        print("STEP 1-2: Loading Cached Features")
+        print("="*60)
+        with np.load(features_path) as cached:
+            X, y = cached['X'], cached['y']
+        encoders = joblib.load(encoders_path)
+        print(f"✓ Features loaded from cache: {features_path}")
+        print(f"✓ Feature matrix: {X.shape}")
+        return X, y, FEATURE_COLUMNS, encoders
+    
+    df = load_and_explore_data()
+    X, y, feature_columns, encoders = feature_engineering(df)
+    
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    
+    # Entries for an older dataset/pipeline can never be hit again
+    current = {os.path.abspath(features_path), os.path.abspath(encoders_path)}
+    for stale in glob.glob(f'{CACHE_DIR}/features_*') + glob.glob(f'{CACHE_DIR}/encoders_*'):
+        if os.path.abspath(stale) not in current:
+            os.remove(stale)
+    
+    # Write to temporary names and rename into place, so an interrupted run
+    # never leaves a truncated entry that looks complete
+    _dump_pickle(encoders, encoders_path + '.tmp')
+    os.replace(encoders_path + '.tmp', encoders_path)
+    with open(features_path + '.tmp', 'wb') as f:
+        np.savez(f, X=X, y=y)
+    os.replace(features_path + '.tmp', features_path)
+    print(f"✓ Features cached: {features_path}")
+    
+    return X, y, feature_columns, encoders
+
+def scale_features(X_train, X_test):
+    """Standardize train/test matrices in place using training statistics"""
+    # Accumulate in float64, apply in the matrices' own float32.
+    # Like StandardScaler, NaNs are ignored in the statistics and stay NaN after scaling.
+    mean = np.nanmean(X_train, axis=0, dtype=np.float64)
+    std = np.nanstd(X_train, axis=0, dtype=np.float64)
+    std[std == 0] = 1.0
+    n_seen = np.count_nonzero(~np.isnan(X_train), axis=0)
+    
+    mean_32 = mean.astype(X_train.dtype)
+    std_32 = std.astype(X_train.dtype)
+    for X in (X_train, X_test):
+        np.subtract(X, mean_32, out=X)
+        np.divide(X, std_32, out=X)
+    
+    # Fitted StandardScaler equivalent, so scaler.pkl keeps its API
+    scaler = StandardScaler()
+    scaler.mean_ = mean
+    scaler.var_ = std ** 2
+    scaler.scale_ = std
+    scaler.n_features_in_ = X_train.shape[1]
+    # sklearn keeps a scalar count unless some column had missing values
+    scaler.n_samples_seen_ = (
+        int(n_seen[0]) if (n_seen == X_train.shape[0]).all() else n_seen.astype(np.int64)
+    )
+    
+    return scaler
 
 def train_model(X_train, y_train):
-    """Train Random Forest classifier"""
+    """Train Histogram Gradient Boosting classifier"""
     print("\n" + "="*60)
-    print("STEP 4: Model Training")
+    print("STEP 3: Model Training")
     print("="*60)
     
-    print(f"\nTraining Random Forest:")
-    print(f"  n_estimators: {N_ESTIMATORS}")
+    print(f"\nTraining Histogram Gradient Boosting:")
+    print(f"  max_iter: {MAX_ITER} (sweep: {MAX_ITER_SWEEP})")
     print(f"  max_depth: {MAX_DEPTH}")
-    print(f"  min_samples_split: {MIN_SAMPLES_SPLIT}")
-    print(f"  min_samples_leaf: {MIN_SAMPLES_LEAF}")
+    print(f"  learning_rate: {LEARNING_RATE}")
+    print(f"  l2_regularization: {L2_REGULARIZATION}")
+    print(f"  max_bins: {MAX_BINS}")
+    print(f"  threads: {N_JOBS}")
     
-    model = RandomForestClassifier(
-        n_estimators=N_ESTIMATORS,
+    model = HistGradientBoostingClassifier(
+        max_iter=MAX_ITER_SWEEP[0],
         max_depth=MAX_DEPTH,
-        min_samples_split=MIN_SAMPLES_SPLIT,
-        min_samples_leaf=MIN_SAMPLES_LEAF,
-        random_state=RANDOM_STATE,
-        n_jobs=-1,
+        learning_rate=LEARNING_RATE,
+        l2_regularization=L2_REGULARIZATION,
+        max_bins=MAX_BINS,
         class_weight='balanced',  # Handle imbalanced dataset
-        verbose=1
+        early_stopping=True,
+        warm_start=True,  # Each sweep step keeps the trees already grown
+        verbose=0,
+        random_state=RANDOM_STATE
     )
     
-    model.fit(X_train, y_train)
+    # Cap OpenMP threads at physical cores to avoid SMT/BLAS oversubscription
+    with threadpool_limits(limits=N_JOBS):
+        for max_iter in MAX_ITER_SWEEP:
+            model.set_params(max_iter=max_iter)
+            model.fit(X_train, y_train)
+            print(f"  max_iter={max_iter:4d}: {model.n_iter_} iterations, "
+                  f"validation loss {-model.validation_score_[-1]:.4f}")
+            
+            if model.n_iter_ < max_iter:
+                print("  Early stopping reached, ending sweep")
+                break
     
-    print("\n✓ Model training completed")
+    print(f"\n✓ Model training completed ({model.n_iter_} boosting iterations)")
     
     return model
 
 def evaluate_model(model, X_train, X_test, y_train, y_test, feature_columns):
     """Evaluate model performance"""
     print("\n" + "="*60)
-    print("STEP 5: Model Evaluation")
+    print("STEP 4: Model Evaluation")
     print("="*60)
     
     # Training performance
     train_score = model.score(X_train, y_train)
     print(f"\nTrain Accuracy: {train_score:.4f}")
     
-    # Test performance
-    test_score = model.score(X_test, y_test)
-    print(f"Test Accuracy: {test_score:.4f}")
-    
-    # Predictions
-    y_pred = model.predict(X_test)
+    # Test predictions: one pass over the ensemble, labels derived from it
     y_pred_proba = model.predict_proba(X_test)[:, 1]
+    y_pred = (y_pred_proba > 0.5).astype(np.int8)
+    
+    # Confusion matrix in a single bincount over (actual, predicted) pairs
+    cm = np.bincount(y_test.astype(np.intp) * 2 + y_pred, minlength=4).reshape(2, 2)
+    test_score = cm.diagonal().sum() / cm.sum()
+    print(f"Test Accuracy: {test_score:.4f}")
     
     # Classification report
     print("\nClassification Report:")
     print(classification_report(y_test, y_pred, target_names=['Legitimate', 'Fraud']))
     
-    # Confusion matrix
-    cm = confusion_matrix(y_test, y_pred)
     print("\nConfusion Matrix:")
     print(f"                 Predicted")
     print(f"               Legit  Fraud")
@@ -221,10 +462,19 @@ def evaluate_model(model, X_train, X_test, y_train, y_test, feature_columns):
     roc_auc = roc_auc_score(y_test, y_pred_proba)
     print(f"\nROC AUC Score: {roc_auc:.4f}")
     
-    # Feature importance
+    # Feature importance (boosted trees expose no impurity importances)
+    # One single-threaded predictor per worker process, no nested thread pools
+    with joblib.parallel_backend('loky', inner_max_num_threads=1):
+        importance = permutation_importance(
+            model, X_test, y_test,
+            scoring='roc_auc',
+            n_repeats=5,
+            random_state=RANDOM_STATE,
+            n_jobs=N_JOBS
+        )
     feature_importance = pd.DataFrame({
         'feature': feature_columns,
-        'importance': model.feature_importances_
+        'importance': importance.importances_mean
     }).sort_values('importance', ascending=False)
     
     print("\nTop 10 Feature Importances:")
@@ -242,22 +492,21 @@ def evaluate_model(model, X_train, X_test, y_train, y_test, feature_columns):
         'feature_importance': feature_importance.to_dict('records')
     }
 
-def save_scaler_and_model(scaler, model, feature_columns, metrics):
-    """Save scaler and model artifacts"""
+def _dump_pickle(obj, path):
+    """Pickle an artifact with protocol 5 and light compression"""
+    joblib.dump(obj, path, compress=ARTIFACT_COMPRESS, protocol=5)
+
+def _dump_json(obj, path):
+    """Write a JSON artifact"""
+    with open(path, 'w') as f:
+        json.dump(obj, f, indent=2)
+
+def save_scaler_and_model(scaler, model, encoders, feature_columns, metrics):
+    """Save scaler, encoders and model metadata (the model itself ships as ONNX)"""
     print("\n" + "="*60)
-    print("STEP 6: Saving Model Artifacts")
+    print("STEP 5: Saving Model Artifacts")
     print("="*60)
     
-    # Save scaler
-    scaler_path = f'{MODELS_DIR}/scaler.pkl'
-    joblib.dump(scaler, scaler_path)
-    print(f"✓ Scaler saved: {scaler_path}")
-    
-    # Save model (sklearn format)
-    model_path = f'{MODELS_DIR}/fraud_model.pkl'
-    joblib.dump(model, model_path)
-    print(f"✓ Model saved: {model_path}")
-    
     # Extract scaler parameters for Java
     scaler_params = {
         'means': scaler.mean_.tolist(),
@@ -265,31 +514,53 @@ def save_scaler_and_model(scaler, model, feature_columns, metrics):
         'n_features': len(feature_columns)
     }
     
-    with open(f'{MODELS_DIR}/scaler_params.json', 'w') as f:
-        json.dump(scaler_params, f, indent=2)
-    print(f"✓ Scaler parameters saved: {MODELS_DIR}/scaler_params.json")
-    
-    # Save metadata
+    # Metadata
     metadata = {
         'n_features': len(feature_columns),
         'feature_names': feature_columns,
         'metrics': metrics,
         'model_config': {
-            'n_estimators': N_ESTIMATORS,
+            'algorithm': 'HistGradientBoostingClassifier',
+            'max_iter': MAX_ITER,
+            'max_iter_sweep': MAX_ITER_SWEEP,
+            'n_iter': int(model.n_iter_),
             'max_depth': MAX_DEPTH,
-            'min_samples_split': MIN_SAMPLES_SPLIT,
-            'min_samples_leaf': MIN_SAMPLES_LEAF
+            'learning_rate': LEARNING_RATE,
+            'l2_regularization': L2_REGULARIZATION,
+            'max_bins': MAX_BINS
         }
     }
     
-    with open(f'{MODELS_DIR}/model_metadata.json', 'w') as f:
-        json.dump(metadata, f, indent=2)
-    print(f"✓ Metadata saved: {MODELS_DIR}/model_metadata.json")
+    artifacts = [
+        ('Scaler', _dump_pickle, scaler, f'{MODELS_DIR}/scaler.pkl'),
+        *[
+            (f'Encoder ({name})', _dump_pickle, encoder, f'{MODELS_DIR}/encoder_{name}.pkl')
+            for name, encoder in encoders.items()
+        ],
+        ('Scaler parameters', _dump_json, scaler_params, f'{MODELS_DIR}/scaler_params.json'),
+        ('Metadata', _dump_json, metadata, f'{MODELS_DIR}/model_metadata.json')
+    ]
+    
+    # Write all artifacts concurrently so disk flushes overlap
+    with ThreadPoolExecutor(max_workers=len(artifacts)) as pool:
+        futures = [pool.submit(write, obj, path) for _, write, obj, path in artifacts]
+    
+    for (label, _, _, path), future in zip(artifacts, futures):
+        future.result()
+        print(f"✓ {label} saved: {path}")
+
+def load_onnx_session(onnx_path):
+    """Open an exported model with ONNX Runtime for in-Python inference"""
+    so = ort.SessionOptions()
+    so.enable_mem_pattern = True
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    so.add_session_config_entry('session.use_device_allocator_for_initializers', '1')
+    return ort.InferenceSession(onnx_path, sess_options=so, providers=['CPUExecutionProvider'])
 
-def convert_to_onnx(model, feature_columns):
+def convert_to_onnx(model, feature_columns, X_check):
     """Convert sklearn model to ONNX format"""
     print("\n" + "="*60)
-    print("STEP 7: ONNX Conversion")
+    print("STEP 6: ONNX Conversion")
     print("="*60)
     
     if not ONNX_AVAILABLE:
@@ -306,9 +577,20 @@ def convert_to_onnx(model, feature_columns):
         onnx_model = convert_sklearn(
             model,
             initial_types=initial_type,
-            target_opset=12
+            target_opset=ONNX_TARGET_OPSET,
+            options={id(model): {'zipmap': False, 'output_class_labels': False}}
         )
         
+        # Keep only the probability tensor; Java never reads the label output
+        for output in list(onnx_model.graph.output):
+            if output.name != ONNX_OUTPUT:
+                onnx_model.graph.output.remove(output)
+        
+        if ONNX_OPTIMIZER_AVAILABLE:
+            n_nodes = len(onnx_model.graph.node)
+            onnx_model = onnxoptimizer.optimize(onnx_model, ONNX_OPTIMIZER_PASSES)
+            print(f"✓ ONNX graph optimized: {n_nodes} -> {len(onnx_model.graph.node)} nodes")
+        
         # Save ONNX model
         onnx_path = f'{MODELS_DIR}/fraud_detection.onnx'
         with open(onnx_path, "wb") as f:
@@ -321,11 +603,142 @@ def convert_to_onnx(model, feature_columns):
         onnx.checker.check_model(onnx_model_check)
         print("✓ ONNX model validation passed")
         
+        # Check the exported graph reproduces the sklearn probabilities
+        if ORT_AVAILABLE:
+            session = load_onnx_session(onnx_path)
+            X_check = np.ascontiguousarray(X_check[:PARITY_SAMPLES], dtype=np.float32)
+            onnx_proba = session.run([ONNX_OUTPUT], {'float_input': X_check})[0][:, 1]
+            max_diff = np.abs(onnx_proba - model.predict_proba(X_check)[:, 1]).max()
+            print(f"✓ ONNX Runtime parity check: max |Δp| = {max_diff:.2e} on {len(X_check)} rows")
+        
         return True
     except Exception as e:
         print(f"✗ ONNX conversion failed: {e}")
         return False
 
+def _c_double(value):
+    """Format a float as a C double literal, spelling non-finite values via <math.h>"""
+    value = float(value)
+    if math.isnan(value):
+        return "NAN"
+    if math.isinf(value):
+        return "INFINITY" if value > 0 else "-INFINITY"
+    return repr(value)
+
+def _tree_to_c(nodes, node_id=0):
+    """Render one boosted tree as a nested C ternary expression"""
+    node = nodes[node_id]
+    if node['is_leaf']:
+        return _c_double(node['value'])
+    
+    feature = int(node['feature_idx'])
+    # +inf when the tree learned a "missing vs. present" split
+    threshold = _c_double(node['num_threshold'])
+    # Written so that NaN inputs follow the tree's learned missing-value branch
+    if node['missing_go_to_left']:
+        condition = f"!((double)x[{feature}] > {threshold})"
+    else:
+        condition = f"(double)x[{feature}] <= {threshold}"
+    
+    left = _tree_to_c(nodes, int(node['left']))
+    right = _tree_to_c(nodes, int(node['right']))
+    return f"({condition} ? {left} : {right})"
+
+def generate_c_source(model, n_features):
+    """Generate straight-line C code for the boosted ensemble"""
+    predictors = [iteration[0] for iteration in model._predictors]
+    if any(p.nodes['is_categorical'].any() for p in predictors):
+        raise ValueError("categorical splits are not supported by the C generator")
+    baseline = float(np.ravel(model._baseline_prediction)[0])
+    
+    lines = [
+        "/* Generated by train_fraud_model.py - do not edit */",
+        "#include <math.h>",
+        "",
+        f"#define N_FEATURES {n_features}",
+        ""
+    ]
+    for k, predictor in enumerate(predictors):
+        lines.append(f"static double predict_tree_{k}(const float* x) {{")
+        lines.append(f"    return {_tree_to_c(predictor.nodes)};")
+        lines.append("}")
+        lines.append("")
+    
+    lines.append("double predict(const float* x) {")
+    lines.append(f"    double raw = {baseline!r};")
+    for k in range(len(predictors)):
+        lines.append(f"    raw += predict_tree_{k}(x);")
+    lines.append("    return 1.0 / (1.0 + exp(-raw));")
+    lines.append("}")
+    lines.append("")
+    lines.append("void predict_batch(const float* X, long n_rows, double* out) {")
+    lines.append("    for (long i = 0; i < n_rows; i++) {")
+    lines.append("        out[i] = predict(X + i * N_FEATURES);")
+    lines.append("    }")
+    lines.append("}")
+    
+    return "\n".join(lines) + "\n"
+
+def check_native_parity(model, lib_path, X_check):
+    """Compare the compiled library's predict_batch against predict_proba"""
+    X_check = np.array(X_check[:PARITY_SAMPLES], dtype=np.float32, order='C')
+    # Knock out one feature per row so the learned missing-value branches are exercised
+    rows = np.arange(0, len(X_check), 7)
+    X_check[rows, rows % X_check.shape[1]] = np.nan
+    
+    lib = ctypes.CDLL(os.path.abspath(lib_path))
+    lib.predict_batch.argtypes = [ctypes.c_void_p, ctypes.c_long, ctypes.c_void_p]
+    lib.predict_batch.restype = None
+    native_proba = np.empty(len(X_check), dtype=np.float64)
+    lib.predict_batch(X_check.ctypes.data, len(X_check), native_proba.ctypes.data)
+    
+    return np.abs(native_proba - model.predict_proba(X_check)[:, 1]).max()
+
+def compile_native_model(model, feature_columns, X_check):
+    """Compile the tree ensemble to a native shared library"""
+    print("\n" + "="*60)
+    print("STEP 7: Native Model Compilation")
+    print("="*60)
+    
+    lib_path = f'{MODELS_DIR}/fraud_detection.so'
+    
+    # Never leave a library from an earlier run behind if this one fails
+    if os.path.exists(lib_path):
+        os.remove(lib_path)
+    
+    compiler = shutil.which(NATIVE_TOOLCHAIN)
+    if compiler is None:
+        print(f"✗ Native compilation skipped - {NATIVE_TOOLCHAIN} not found")
+        return False
+    
+    try:
+        # The source is only a build intermediate; keep it out of the classpath
+        with tempfile.TemporaryDirectory() as build_dir:
+            src_path = os.path.join(build_dir, 'fraud_detection.c')
+            print("\nGenerating C source from the fitted trees...")
+            with open(src_path, 'w') as f:
+                f.write(generate_c_source(model, len(feature_columns)))
+            
+            print(f"Compiling shared library with {NATIVE_TOOLCHAIN}...")
+            subprocess.run(
+                [compiler, *NATIVE_CFLAGS, '-o', lib_path, src_path, '-lm'],
+                check=True
+            )
+        
+        max_diff = check_native_parity(model, lib_path, X_check)
+        if max_diff > 1e-6:
+            raise ValueError(f"compiled model disagrees with predict_proba (max |Δp| = {max_diff:.2e})")
+        print(f"✓ Native parity check: max |Δp| = {max_diff:.2e}")
+        
+        print(f"✓ Native model saved: {lib_path}")
+        
+        return True
+    except Exception as e:
+        if os.path.exists(lib_path):
+            os.remove(lib_path)
+        print(f"✗ Native compilation failed: {e}")
+        return False
+
 def main():
     """Main training pipeline"""
     print("\n" + "="*60)
@@ -335,29 +748,28 @@ def main():
     # Create directories
     create_dirs()
     
-    # Load data
-    df = load_and_explore_data()
-    
-    # Feature engineering
-    df, encoders = feature_engineering(df)
-    
-    # Prepare features
-    X, y, feature_columns = prepare_features(df)
+    # Load data and engineer features (cached per dataset version)
+    X, y, feature_columns, encoders = load_features()
     
     # Split data
     print("\n" + "="*60)
     print("Splitting Data")
     print("="*60)
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y
-    )
+    splitter = StratifiedShuffleSplit(n_splits=1, test_size=TEST_SIZE, random_state=RANDOM_STATE)
+    train_idx, test_idx = next(splitter.split(np.empty((len(y), 0)), y))
+    
+    # Gather each split once into contiguous arrays, then release the full matrix
+    X_train = np.take(X, train_idx, axis=0)
+    X_test = np.take(X, test_idx, axis=0)
+    y_train = np.take(y, train_idx)
+    y_test = np.take(y, test_idx)
+    del X
     print(f"Train set: {X_train.shape[0]} samples")
     print(f"Test set: {X_test.shape[0]} samples")
     
     # Scale features
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    scaler = scale_features(X_train, X_test)
+    X_train_scaled, X_test_scaled = X_train, X_test
     print("✓ Features scaled")
     
     # Train model
@@ -368,20 +780,24 @@ def main():
                             y_train, y_test, feature_columns)
     
     # Save artifacts
-    save_scaler_and_model(scaler, model, feature_columns, metrics)
+    save_scaler_and_model(scaler, model, encoders, feature_columns, metrics)
     
     # Convert to ONNX
-    onnx_success = convert_to_onnx(model, feature_columns)
+    onnx_success = convert_to_onnx(model, feature_columns, X_train_scaled)
+    
+    # Compile native model
+    native_success = compile_native_model(model, feature_columns, X_test_scaled)
     
     # Final summary
     print("\n" + "="*60)
     print("TRAINING COMPLETE!")
     print("="*60)
-    print(f"\n✓ Sklearn model: {MODELS_DIR}/fraud_model.pkl")
-    print(f"✓ Scaler: {MODELS_DIR}/scaler.pkl")
+    print(f"\n✓ Scaler: {MODELS_DIR}/scaler.pkl")
     print(f"✓ Metadata: {MODELS_DIR}/model_metadata.json")
     if onnx_success:
         print(f"✓ ONNX model: {MODELS_DIR}/fraud_detection.onnx")
+    if native_success:
+        print(f"✓ Native model: {MODELS_DIR}/fraud_detection.so")
     print(f"\nTest Accuracy: {metrics['test_accuracy']:.4f}")
     print(f"ROC AUC Score: {metrics['roc_auc']:.4f}")
     print("\nNext steps:")
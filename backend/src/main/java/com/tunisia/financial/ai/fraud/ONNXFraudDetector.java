@@ -17,7 +17,7 @@ import java.util.List;
 
 /**
  * Fraud detector implementation using ONNX Runtime
- * Uses trained Random Forest model exported from scikit-learn
+ * Uses trained tree ensemble model exported from scikit-learn
  * Features: 16 engineered features matching the Python training pipeline
  */
 @Component
@@ -28,6 +28,7 @@ public class ONNXFraudDetector implements FraudDetectionStrategy {
     private OrtSession session;
     private static final String MODEL_NAME = "ONNX-Runtime";
     private static final int NUM_FEATURES = 16;
+    private static final String PROBABILITY_OUTPUT = "probabilities";
     
     // Scaler parameters from training (scaler_params.json)
     private static final float[] FEATURE_MEANS = {
@@ -244,18 +245,24 @@ public class ONNXFraudDetector implements FraudDetectionStrategy {
             // Run inference
             OrtSession.Result results = session.run(Collections.singletonMap("float_input", inputTensor));
             
-            // Extract prediction  
-            // RandomForest models return: [label, probability_distribution]
-            // Probability output is index 1
-            Object probabilityOutput = results.get(1).getValue();
+            // Extract prediction
+            // Current exports have a single [N, 2] float tensor named "probabilities";
+            // older (ZipMap) exports return [label, probability_distribution] at index 1
+            Object probabilityOutput = results.get(PROBABILITY_OUTPUT)
+                    .orElseGet(() -> results.get(1))
+                    .getValue();
             
             log.debug("ONNX output class: {}", probabilityOutput.getClass().getName());
             log.debug("ONNX output value: {}", probabilityOutput);
             
             double fraudProbability = 0.5; // Default fallback
             
-            // The output is a List containing Maps {class_id -> probability}
-            if (probabilityOutput instanceof List) {
+            if (probabilityOutput instanceof float[][]) {
+                float[][] probabilities = (float[][]) probabilityOutput;
+                fraudProbability = probabilities[0][1]; // Class 1 = fraud
+                log.info("ONNX fraud probability: {}", fraudProbability);
+            } else if (probabilityOutput instanceof List) {
+                // Legacy output: a List containing Maps {class_id -> probability}
                 List<?> resultList = (List<?>) probabilityOutput;
                 if (!resultList.isEmpty()) {
                     // Get first prediction (we only have 1 sample)